@@ -0,0 +1,194 @@
+import math
+
+GRID_CELL = 8.0
+JND_DELTA_E = 2.3
+
+# sRGB (D65) to XYZ, reference white D65
+XYZ_MATRIX = (
+    (0.4124564, 0.3575761, 0.1804375),
+    (0.2126729, 0.7151522, 0.0721750),
+    (0.0193339, 0.1191920, 0.9503041),
+)
+WHITE = (0.95047, 1.0, 1.08883)
+
+_lab_table = None
+
+
+def rgb565_to_rgb888(rgb565):
+    return ((rgb565 >> 11) & 0x1F) << 3, ((rgb565 >> 5) & 0x3F) << 2, (rgb565 & 0x1F) << 3
+
+
+def srgb_to_linear(value):
+    value /= 255.0
+    if value <= 0.04045:
+        return value / 12.92
+    return ((value + 0.055) / 1.055) ** 2.4
+
+
+def lab_f(t):
+    if t > 216 / 24389:
+        return t ** (1 / 3)
+    return (24389 / 27 * t + 16) / 116
+
+
+def rgb888_to_lab(r, g, b):
+    lr, lg, lb = srgb_to_linear(r), srgb_to_linear(g), srgb_to_linear(b)
+    fx, fy, fz = (lab_f((m[0] * lr + m[1] * lg + m[2] * lb) / w) for m, w in zip(XYZ_MATRIX, WHITE))
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def lab_table():
+    # Built once on first use: 65536 entries, one per RGB565 value. Channel
+    # linearization is shared across entries, so only the matrix and cube
+    # roots run per color.
+    global _lab_table
+    if _lab_table is None:
+        red = [srgb_to_linear(v << 3) for v in range(32)]
+        green = [srgb_to_linear(v << 2) for v in range(64)]
+        blue = red
+        (m00, m01, m02), (m10, m11, m12), (m20, m21, m22) = XYZ_MATRIX
+        wx, wy, wz = WHITE
+        table = []
+        for r in red:
+            for g in green:
+                for b in blue:
+                    fx = lab_f((m00 * r + m01 * g + m02 * b) / wx)
+                    fy = lab_f((m10 * r + m11 * g + m12 * b) / wy)
+                    fz = lab_f((m20 * r + m21 * g + m22 * b) / wz)
+                    table.append((116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)))
+        _lab_table = table
+    return _lab_table
+
+
+def rgb565_to_lab(rgb565):
+    return lab_table()[rgb565]
+
+
+def delta_e(c1, c2):
+    # CIE76: Euclidean distance in Lab
+    if c1 == c2:
+        return 0.0
+    table = lab_table()
+    l1, a1, b1 = table[c1]
+    l2, a2, b2 = table[c2]
+    return math.sqrt((l1 - l2) ** 2 + (a1 - a2) ** 2 + (b1 - b2) ** 2)
+
+
+class PaletteIndex:
+    # Uniform grid over Lab space. Nearest-color queries search shells of
+    # cells outward from the query and stop once no unsearched cell can hold
+    # a closer color; results are memoized per RGB565 value, so repeated
+    # lookups (snapping a whole image) are a single dict hit.
+
+    def __init__(self, colors=(), cell_size=GRID_CELL):
+        self.cell_size = cell_size
+        self.colors = []
+        self._grid = {}
+        self._cache = {}
+        for color in colors:
+            self.add(color)
+
+    def __len__(self):
+        return len(self.colors)
+
+    def _cell(self, lab):
+        size = self.cell_size
+        return int(lab[0] // size), int(lab[1] // size), int(lab[2] // size)
+
+    def add(self, color):
+        lab = rgb565_to_lab(color)
+        self._grid.setdefault(self._cell(lab), []).append((color, lab))
+        self.colors.append(color)
+        self._cache.clear()
+
+    def _scan(self, cells, lab, best, best_d2):
+        l, a, b = lab
+        for cell in cells:
+            for color, (cl, ca, cb) in self._grid.get(cell, ()):
+                d2 = (cl - l) ** 2 + (ca - a) ** 2 + (cb - b) ** 2
+                if d2 < best_d2:
+                    best, best_d2 = color, d2
+        return best, best_d2
+
+    def nearest(self, color):
+        cached = self._cache.get(color)
+        if cached is not None:
+            return cached
+        if not self.colors:
+            return None
+
+        lab = rgb565_to_lab(color)
+        qx, qy, qz = self._cell(lab)
+        best, best_d2 = None, math.inf
+        r = 0
+        while True:
+            if (2 * r + 1) ** 3 >= len(self._grid):
+                # The shell is larger than the occupied grid: finish by
+                # scanning every cell not searched yet.
+                rest = [c for c in self._grid
+                        if max(abs(c[0] - qx), abs(c[1] - qy), abs(c[2] - qz)) >= r]
+                best, best_d2 = self._scan(rest, lab, best, best_d2)
+                break
+            shell = [(qx + dx, qy + dy, qz + dz)
+                     for dx in range(-r, r + 1)
+                     for dy in range(-r, r + 1)
+                     for dz in range(-r, r + 1)
+                     if max(abs(dx), abs(dy), abs(dz)) == r]
+            best, best_d2 = self._scan(shell, lab, best, best_d2)
+            if best is not None and math.sqrt(best_d2) <= r * self.cell_size:
+                break
+            r += 1
+
+        self._cache[color] = best
+        return best
+
+    def within(self, color, radius):
+        lab = rgb565_to_lab(color)
+        qx, qy, qz = self._cell(lab)
+        reach = int(math.ceil(radius / self.cell_size))
+        l, a, b = lab
+        radius2 = radius * radius
+        found = []
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                for dz in range(-reach, reach + 1):
+                    for other, (cl, ca, cb) in self._grid.get((qx + dx, qy + dy, qz + dz), ()):
+                        if (cl - l) ** 2 + (ca - a) ** 2 + (cb - b) ** 2 <= radius2:
+                            found.append(other)
+        return found
+
+
+def merge_similar(colors, threshold=JND_DELTA_E):
+    # Keeps the first color of every group closer than `threshold`.
+    index = PaletteIndex()
+    for color in colors:
+        if not index.within(color, threshold):
+            index.add(color)
+    return index.colors
+
+
+def snap_to_palette(data, colors):
+    index = PaletteIndex(colors)
+    if not index.colors:
+        return list(data)
+    return [index.nearest(value) for value in data]
+
+
+def fill_region(data, width, height, x, y, tolerance=0):
+    # Pixels 4-connected to (x, y) whose color is within `tolerance` of the
+    # start pixel; a tolerance of 0 only accepts the exact color.
+    target = data[y * width + x]
+    visited = bytearray(width * height)
+    stack = [(x, y)]
+    region = []
+    while stack:
+        cx, cy = stack.pop()
+        if cx < 0 or cx >= width or cy < 0 or cy >= height or visited[cy * width + cx]:
+            continue
+        visited[cy * width + cx] = 1
+        color = data[cy * width + cx]
+        if color != target and (not tolerance or delta_e(color, target) > tolerance):
+            continue
+        region.append((cx, cy))
+        stack.extend([(cx + 1, cy), (cx - 1, cy), (cx, cy + 1), (cx, cy - 1)])
+    return region
@@ -0,0 +1,228 @@
+import os
+import re
+import tempfile
+
+from rgb565 import pack_rgb565, pack_rgb565_be
+
+EXPORT_FORMATS = {
+    'uint16': 'uint16_t array (PROGMEM)',
+    'uint8': 'uint8_t byte array',
+    'lvgl': 'LVGL image descriptor',
+    'gfx': 'Adafruit GFX 1-bit bitmap',
+}
+EXPORT_BUFFER_SIZE = 64 * 1024
+DEFAULT_PER_LINE = 16
+
+
+class ExportError(Exception):
+    pass
+
+
+def c_identifier(name):
+    name = re.sub(r'\W', '_', name.strip(), flags=re.ASCII)
+    if not name:
+        raise ExportError("Empty array name")
+    if name[0].isdigit():
+        name = '_' + name
+    return name
+
+
+def attributes(align=0, section=None):
+    attrs = []
+    if align:
+        if align & (align - 1):
+            raise ExportError(f"Alignment must be a power of two: {align}")
+        attrs.append(f'aligned({align})')
+    if section:
+        attrs.append(f'section("{section}")')
+    return f' __attribute__(({", ".join(attrs)}))' if attrs else ''
+
+
+def image_bytes(data, endian):
+    return pack_rgb565_be(data) if endian == 'big' else pack_rgb565(data)
+
+
+def mono_bytes(data, width, height):
+    # Adafruit GFX drawBitmap layout: MSB first, each row padded to a byte,
+    # any non-black pixel is a set bit.
+    out = bytearray()
+    for y in range(height):
+        row = data[y * width:(y + 1) * width]
+        for x in range(0, width, 8):
+            byte = 0
+            for bit, value in enumerate(row[x:x + 8]):
+                if value:
+                    byte |= 0x80 >> bit
+            out.append(byte)
+    return bytes(out)
+
+
+def rle_encode(data, max_run=0xFFFF):
+    # Pairs of (run length, RGB565 value)
+    out = []
+    run, prev = 0, None
+    for value in data:
+        if value == prev and run < max_run:
+            run += 1
+            continue
+        if prev is not None:
+            out.extend((run, prev))
+        run, prev = 1, value
+    if prev is not None:
+        out.extend((run, prev))
+    return out
+
+
+def value_lines(values, digits, per_line):
+    fmt = f'0x{{:0{digits}X}}'
+    for i in range(0, len(values), per_line):
+        yield '  ' + ', '.join(fmt.format(v) for v in values[i:i + per_line]) + ',\n'
+
+
+def array_lines(ctype, name, values, digits, per_line, attrs, progmem):
+    storage = ' PROGMEM' if progmem else ''
+    yield f'const {ctype} {name}[{len(values)}]{storage}{attrs} = {{\n'
+    yield from value_lines(values, digits, per_line)
+    yield '};\n'
+
+
+def prologue_lines(guard, fmt, progmem):
+    yield f'#ifndef {guard}\n'
+    yield f'#define {guard}\n'
+    yield '\n'
+    yield '#include <stdint.h>\n'
+    if fmt == 'lvgl':
+        yield '#include "lvgl.h"\n'
+    elif progmem:
+        yield '\n'
+        yield '#if defined(__AVR__)\n'
+        yield '#include <avr/pgmspace.h>\n'
+        yield '#elif !defined(PROGMEM)\n'
+        yield '#define PROGMEM\n'
+        yield '#endif\n'
+
+
+def image_values(fmt, data, width, height, endian, rle):
+    # The C element type, hex digits per value and the values as emitted
+    if fmt == 'uint16':
+        return 'uint16_t', 4, rle_encode(data) if rle else data
+    if fmt == 'uint8':
+        return 'uint8_t', 2, image_bytes(rle_encode(data) if rle else data, endian)
+    if fmt == 'lvgl':
+        return 'uint8_t', 2, image_bytes(data, endian)
+    return 'uint8_t', 2, mono_bytes(data, width, height)
+
+
+def image_identifiers(fmt, name, shared, rle):
+    if fmt == 'lvgl':
+        return [name] if shared else [name, f'{name}_map']
+    upper = name.upper()
+    idents = [name, f'{upper}_WIDTH', f'{upper}_HEIGHT', f'{upper}_LENGTH']
+    if rle:
+        idents.append(f'{upper}_RLE')
+    return idents
+
+
+def image_lines(fmt, name, width, height, ctype, digits, values, shared, per_line, attrs, progmem, rle=False):
+    # `shared` names an array already emitted with identical contents; the
+    # image then reuses it instead of repeating the data.
+    upper = name.upper()
+    if fmt == 'lvgl':
+        map_name = shared or f'{name}_map'
+        if not shared:
+            yield f'const LV_ATTRIBUTE_MEM_ALIGN LV_ATTRIBUTE_LARGE_CONST uint8_t {map_name}[{len(values)}]{attrs} = {{\n'
+            yield from value_lines(values, digits, per_line)
+            yield '};\n'
+            yield '\n'
+        yield f'const lv_img_dsc_t {name} = {{\n'
+        yield '  .header.cf = LV_IMG_CF_TRUE_COLOR,\n'
+        yield '  .header.always_zero = 0,\n'
+        yield '  .header.reserved = 0,\n'
+        yield f'  .header.w = {width},\n'
+        yield f'  .header.h = {height},\n'
+        yield f'  .data_size = {len(values)},\n'
+        yield f'  .data = {map_name},\n'
+        yield '};\n'
+        return
+
+    yield f'#define {upper}_WIDTH {width}\n'
+    yield f'#define {upper}_HEIGHT {height}\n'
+    yield f'#define {upper}_LENGTH {len(values)}\n'
+    if rle:
+        yield f'#define {upper}_RLE 1\n'
+    if shared:
+        # A typed pointer rather than a macro, so the alias name cannot clash
+        # with identifiers in the including code. The pointer itself lives in
+        # RAM; the data it points to stays where the shared array was placed.
+        note = '  // points to PROGMEM data' if progmem else ''
+        yield f'static const {ctype} *const {name} = {shared};{note}\n'
+    else:
+        yield from array_lines(ctype, name, values, digits, per_line, attrs, progmem)
+
+
+def header_lines(guard, images, fmt='uint16', endian='little', per_line=DEFAULT_PER_LINE,
+                 align=0, section=None, progmem=True, rle=False):
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"Unknown export format: {fmt}")
+    if rle and fmt not in ('uint16', 'uint8'):
+        raise ExportError(f"RLE is not supported for {fmt}")
+    if endian not in ('little', 'big'):
+        raise ExportError(f"Unknown byte order: {endian}")
+    if per_line < 1:
+        raise ExportError("Values per line must be positive")
+
+    # A section attribute places the data itself, so it replaces PROGMEM.
+    progmem = progmem and not section
+    attrs = attributes(align, section)
+
+    yield from prologue_lines(guard, fmt, progmem)
+    emitted = {}
+    defined = {guard}
+    for image_name, data, width, height in images:
+        name = c_identifier(image_name)
+        if len(data) != width * height:
+            raise ExportError(f"Image {name} does not match its size {width}x{height}")
+
+        # Images share an array only when the emitted values are identical,
+        # e.g. two differently colored shapes with the same 1-bit mask.
+        ctype, digits, values = image_values(fmt, data, width, height, endian, rle)
+        key = (width, height, tuple(values))
+        shared = emitted.get(key)
+
+        # C names are case-sensitive but the macros are upper-cased, and LVGL
+        # adds a _map suffix, so different image names can still collide.
+        for ident in image_identifiers(fmt, name, shared, rle):
+            if ident in defined:
+                raise ExportError(f"Image {image_name} would redefine {ident}")
+            defined.add(ident)
+
+        if shared is None:
+            emitted[key] = f'{name}_map' if fmt == 'lvgl' else name
+
+        yield '\n'
+        yield from image_lines(fmt, name, width, height, ctype, digits, values, shared,
+                               per_line, attrs, progmem, rle)
+
+    yield '\n'
+    yield f'#endif // {guard}\n'
+
+
+def header_guard(path):
+    return c_identifier(os.path.basename(path)).upper()
+
+
+def write_header(path, images, **options):
+    # A unique temp file per call, so two exports or pipeline builds of the
+    # same header never write into each other's file.
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'w', encoding='ascii', newline='\n', buffering=EXPORT_BUFFER_SIZE) as f:
+            f.writelines(header_lines(header_guard(path), images, **options))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -1,15 +1,25 @@
 import sys
 import json
 import os
+import threading
 import traceback
 
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QMessageBox,
                              QPushButton, QLabel, QFileDialog, QDialog,
-                             QVBoxLayout)
-from PyQt5.QtCore import (Qt, pyqtSignal)
+                             QVBoxLayout, QInputDialog)
+from PyQt5.QtCore import (Qt, QPoint, pyqtSignal)
 from PyQt5.QtGui import (QPainter, QImage, QPixmap, QColor)
 from PyQt5 import uic
 
+from colormath import JND_DELTA_E, fill_region, merge_similar
+from colormath import snap_to_palette as snap_colors
+from export import EXPORT_FORMATS, ExportError, write_header
+from pipeline import resize, rotate
+from preview import PreviewError, PreviewSender, open_transport
+from project import (PROJECT_EXTENSION, AutosaveWriter, ProjectError,
+                     orphaned_autosaves, read_project, release_autosave,
+                     write_project)
+
 DEFAULT_WIDTH = 15
 DEFAULT_HEIGHT = 15
 MIN_SCALE = 2
@@ -117,6 +127,7 @@ class CanvasWidget(QLabel):
         self.selection_start = None
         self.selection_end = None
         self.selecting = False
+        self.fill_tolerance = 0
 
         self.setMouseTracking(True)
         self.setMinimumSize(400, 400)
@@ -246,23 +257,13 @@ class CanvasWidget(QLabel):
 
         target = self.image.pixelColor(x, y)
         fill = ColorButton.rgb565_to_qcolor(self.current_color_rgb565)
-        if target == fill:
+        tolerance = self.fill_tolerance
+        if target == fill and not tolerance:
             return
 
         w, h = self.image.width(), self.image.height()
-        stack = [(x, y)]
-        visited = [[False] * w for _ in range(h)]
-
-        while stack:
-            cx, cy = stack.pop()
-            if cx < 0 or cx >= w or cy < 0 or cy >= h or visited[cy][cx]:
-                continue
-            if self.image.pixelColor(cx, cy) != target:
-                continue
-
-            visited[cy][cx] = True
+        for cx, cy in fill_region(self.get_image_data(), w, h, x, y, tolerance):
             self.image.setPixelColor(cx, cy, fill)
-            stack.extend([(cx + 1, cy), (cx - 1, cy), (cx, cy + 1), (cx, cy - 1)])
 
     def set_scale(self, scale):
         self.scale = max(MIN_SCALE, min(MAX_SCALE, scale))
@@ -276,6 +277,8 @@ class CanvasWidget(QLabel):
 
 
 class PixelEditor(QMainWindow):
+    projectSaved = pyqtSignal(str, str)
+
     def __init__(self, ui_path='pixel_editor.ui'):
         super().__init__()
         self.current_color_rgb565 = 0x0000
@@ -284,6 +287,9 @@ class PixelEditor(QMainWindow):
         self.history = []
         self.history_index = -1
         self.ui_path = ui_path
+        self.autosave = None
+        self.preview = None
+        self.preview_spec = 'loopback'
 
         self.setup_ui()
         self.setup_canvas()
@@ -294,6 +300,11 @@ class PixelEditor(QMainWindow):
 
         self.canvas.current_color_rgb565 = self.current_color_rgb565
         self.update_color_preview()
+        try:
+            self.autosave = AutosaveWriter()
+        except OSError as e:
+            print(f"Autosave disabled: {e}")
+        self.recover_autosave()
 
     def setup_ui(self):
         if not os.path.exists(self.ui_path):
@@ -369,16 +380,31 @@ class PixelEditor(QMainWindow):
             self.btnSavePNG.clicked.connect(self.save_png)
         if hasattr(self, 'btnLoadPNG'):
             self.btnLoadPNG.clicked.connect(self.load_png)
+        if hasattr(self, 'btnExportHeader'):
+            self.btnExportHeader.clicked.connect(self.export_header)
+        if hasattr(self, 'btnSaveProject'):
+            self.btnSaveProject.clicked.connect(self.save_project)
+        if hasattr(self, 'btnLoadProject'):
+            self.btnLoadProject.clicked.connect(self.load_project)
         if hasattr(self, 'btnApplySize'):
             self.btnApplySize.clicked.connect(self.apply_size)
         if hasattr(self, 'btnRotate90'):
             self.btnRotate90.clicked.connect(self.rotate_90)
+        if hasattr(self, 'btnPreview'):
+            self.btnPreview.setCheckable(True)
+            self.btnPreview.clicked.connect(self.toggle_preview)
         if hasattr(self, 'btnAddColor'):
             self.btnAddColor.clicked.connect(self.add_color)
         if hasattr(self, 'btnRemoveColor'):
             self.btnRemoveColor.clicked.connect(self.remove_selected_color)
         if hasattr(self, 'btnSaveColor'):
             self.btnSaveColor.clicked.connect(self.save_palette)
+        if hasattr(self, 'btnMergeColors'):
+            self.btnMergeColors.clicked.connect(self.merge_similar_colors)
+        if hasattr(self, 'btnSnapPalette'):
+            self.btnSnapPalette.clicked.connect(self.snap_to_palette)
+        if hasattr(self, 'spinTolerance'):
+            self.spinTolerance.valueChanged.connect(self.set_fill_tolerance)
 
         if hasattr(self, 'btnZoomIn'):
             self.btnZoomIn.clicked.connect(self.zoom_in)
@@ -396,6 +422,7 @@ class PixelEditor(QMainWindow):
         self.canvas.pixelClicked.connect(self.on_pixel_clicked)
         self.canvas.pixelHovered.connect(self.on_pixel_hovered)
         self.canvas.imageChanged.connect(self.on_image_changed)
+        self.projectSaved.connect(self.on_project_saved)
 
         self.update_info()
 
@@ -504,6 +531,7 @@ class PixelEditor(QMainWindow):
             self.history.pop(0)
         self.history_index = len(self.history) - 1
         self.update_undo_redo_buttons()
+        self.publish_state()
 
     def undo(self):
         if self.history_index > 0:
@@ -515,6 +543,7 @@ class PixelEditor(QMainWindow):
             self.update_text_from_image()
             self.update_undo_redo_buttons()
             self.update_info()
+            self.publish_state()
 
     def redo(self):
         if self.history_index < len(self.history) - 1:
@@ -526,6 +555,7 @@ class PixelEditor(QMainWindow):
             self.update_text_from_image()
             self.update_undo_redo_buttons()
             self.update_info()
+            self.publish_state()
 
     def clear_canvas(self):
         reply = QMessageBox.question(self, 'Clear', 'Are you sure?', QMessageBox.Yes | QMessageBox.No)
@@ -543,44 +573,32 @@ class PixelEditor(QMainWindow):
         if not hasattr(self, 'spinWidth') or not self.canvas.image:
             return
 
-        w, h = self.spinWidth.value(), self.spinHeight.value()
-        old_data = self.canvas.get_image_data()
-        old_w, old_h = self.canvas.image.width(), self.canvas.image.height()
-
-        self.canvas.set_image_size(w, h)
-        if old_data:
-            for y in range(min(old_h, h)):
-                for x in range(min(old_w, w)):
-                    color = ColorButton.rgb565_to_qcolor(old_data[y * old_w + x])
-                    self.canvas.image.setPixelColor(x, y, color)
-
-        self.canvas.update_pixmap()
+        image = resize(self.canvas_image(), self.spinWidth.value(), self.spinHeight.value())
+        self.canvas.blockSignals(True)
+        self.canvas.set_image_data(image['data'], image['width'], image['height'])
+        self.canvas.blockSignals(False)
         self.save_to_history()
         self.update_text_from_image()
+        self.update_info()
 
     def rotate_90(self):
         if not self.canvas.image:
             return
 
+        image = rotate(self.canvas_image())
         self.canvas.blockSignals(True)
-        old_data = self.canvas.get_image_data()
-        old_w, old_h = self.canvas.image.width(), self.canvas.image.height()
-        new_w, new_h = old_h, old_w
-
-        new_image = QImage(new_w, new_h, QImage.Format_RGB16)
-        new_image.fill(Qt.black)
-
-        for y in range(old_h):
-            for x in range(old_w):
-                color = ColorButton.rgb565_to_qcolor(old_data[y * old_w + x])
-                new_image.setPixelColor(old_h - 1 - y, x, color)
-
-        self.canvas.image = new_image
-        self.canvas.update_pixmap()
+        self.canvas.set_image_data(image['data'], image['width'], image['height'])
         self.canvas.blockSignals(False)
         self.canvas.imageChanged.emit()
         self.update_text_from_image()
 
+    def canvas_image(self):
+        return {
+            'data': self.canvas.get_image_data(),
+            'width': self.canvas.image.width(),
+            'height': self.canvas.image.height(),
+        }
+
     def update_text_from_image(self):
         if not self.canvas.image:
             return
@@ -664,6 +682,30 @@ class PixelEditor(QMainWindow):
             self.create_color_buttons(colors)
             self.selected_color_button = None
 
+    def merge_similar_colors(self):
+        colors = [btn.color_rgb565 for btn in self.color_buttons]
+        threshold, ok = QInputDialog.getDouble(self, "Merge Similar", "Max color difference (ΔE):",
+                                               JND_DELTA_E, 0.1, 100.0, 1)
+        if ok:
+            merged = merge_similar(colors, threshold)
+            if len(merged) < len(colors):
+                self.create_color_buttons(merged)
+            QMessageBox.information(self, "Merge Similar", f"Removed {len(colors) - len(merged)} colors")
+
+    def snap_to_palette(self):
+        if not self.canvas.image or not self.color_buttons:
+            return
+
+        w, h = self.canvas.image.width(), self.canvas.image.height()
+        data = snap_colors(self.canvas.get_image_data(), [btn.color_rgb565 for btn in self.color_buttons])
+        self.canvas.blockSignals(True)
+        self.canvas.set_image_data(data, w, h)
+        self.canvas.blockSignals(False)
+        self.canvas.imageChanged.emit()
+
+    def set_fill_tolerance(self, value):
+        self.canvas.fill_tolerance = value
+
     def save_palette(self):
         try:
             with open('palette.json', 'w') as f:
@@ -697,6 +739,36 @@ class PixelEditor(QMainWindow):
             else:
                 QMessageBox.warning(self, "Error", "Could not save image")
 
+    def export_header(self):
+        if not self.canvas.image:
+            return
+
+        labels = list(EXPORT_FORMATS.values())
+        label, ok = QInputDialog.getItem(self, "Export Header", "Format:", labels, 0, False)
+        if not ok:
+            return
+        fmt = list(EXPORT_FORMATS)[labels.index(label)]
+
+        endian = 'little'
+        if fmt in ('uint8', 'lvgl'):
+            endian, ok = QInputDialog.getItem(self, "Export Header", "Byte order:", ['little', 'big'], 0, False)
+            if not ok:
+                return
+
+        filename, _ = QFileDialog.getSaveFileName(self, "Export Header", "img", "C Headers (*.h)")
+        if filename:
+            if not filename.endswith('.h'):
+                filename += '.h'
+
+            name = os.path.splitext(os.path.basename(filename))[0]
+            image = (name, self.canvas.get_image_data(), self.canvas.image.width(), self.canvas.image.height())
+            try:
+                write_header(filename, [image], fmt=fmt, endian=endian)
+            except (OSError, ValueError, ExportError) as e:
+                QMessageBox.warning(self, "Error", f"Could not export header: {e}")
+            else:
+                QMessageBox.information(self, "Success", f"Header saved: {filename}")
+
     def load_png(self):
         filename, _ = QFileDialog.getOpenFileName(self, "Load PNG", "", "PNG Images (*.png)")
         if filename:
@@ -712,6 +784,181 @@ class PixelEditor(QMainWindow):
             else:
                 QMessageBox.warning(self, "Error", "Could not load image")
 
+    def selection_rect(self):
+        if self.canvas.selection_start and self.canvas.selection_end:
+            return [self.canvas.selection_start.x(), self.canvas.selection_start.y(),
+                    self.canvas.selection_end.x(), self.canvas.selection_end.y()]
+        return None
+
+    def project_state(self):
+        state = self.canvas_image()
+        state.update({
+            'palette': [btn.color_rgb565 for btn in self.color_buttons],
+            'selection': self.selection_rect(),
+            'history': list(self.history),
+            'history_index': self.history_index,
+        })
+        return state
+
+    def apply_project_state(self, state):
+        w, h = state['width'], state['height']
+        if hasattr(self, 'spinWidth'):
+            self.spinWidth.setValue(w)
+            self.spinHeight.setValue(h)
+
+        self.canvas.blockSignals(True)
+        self.canvas.set_image_data(state['data'], w, h)
+        self.canvas.blockSignals(False)
+
+        if state['selection']:
+            x1, y1, x2, y2 = state['selection']
+            self.canvas.selection_start = QPoint(x1, y1)
+            self.canvas.selection_end = QPoint(x2, y2)
+        else:
+            self.canvas.selection_start = None
+            self.canvas.selection_end = None
+        self.canvas.update_pixmap()
+
+        if state['palette']:
+            self.create_color_buttons(state['palette'])
+
+        if state['history']:
+            self.history = state['history']
+            self.history_index = min(max(state['history_index'], 0), len(self.history) - 1)
+        else:
+            self.history = []
+            self.history_index = -1
+        self.save_to_history()
+
+        self.update_text_from_image()
+        self.update_undo_redo_buttons()
+        self.update_info()
+        # save_to_history skips the push when the canvas already matches the
+        # restored history entry, so publish explicitly.
+        self.publish_state()
+
+    def publish_state(self):
+        if self.preview and self.preview.error:
+            error = self.preview.error
+            self.stop_preview()
+            QMessageBox.warning(self, "Error", f"Device preview stopped: {error}")
+
+        if self.history_index < 0 or not (self.autosave or self.preview):
+            return
+
+        # Called right after the canvas was stored in history (or restored
+        # from it), so the entry already holds the pixels; scanning the
+        # canvas again would cost another full pass per pencil stroke.
+        entry = self.history[self.history_index]
+        if self.autosave:
+            state = dict(entry)
+            state['palette'] = [btn.color_rgb565 for btn in self.color_buttons]
+            state['selection'] = self.selection_rect()
+            self.autosave.submit(state)
+        if self.preview:
+            self.preview.submit(entry['data'], entry['width'], entry['height'])
+
+    def toggle_preview(self):
+        if self.preview:
+            self.stop_preview()
+            return
+
+        spec, ok = QInputDialog.getText(self, "Device Preview",
+                                        "Transport (serial:PORT[@BAUD], tcp:HOST:PORT, loopback):",
+                                        text=self.preview_spec)
+        spec = spec.strip()
+        if ok and spec:
+            try:
+                transport = open_transport(spec)
+            except PreviewError as e:
+                QMessageBox.warning(self, "Error", f"Could not connect: {e}")
+            else:
+                self.preview_spec = spec
+                self.preview = PreviewSender(transport)
+                self.publish_state()
+
+        if hasattr(self, 'btnPreview'):
+            self.btnPreview.setChecked(self.preview is not None)
+
+    def stop_preview(self):
+        if self.preview:
+            self.preview.close()
+            self.preview = None
+        if hasattr(self, 'btnPreview'):
+            self.btnPreview.setChecked(False)
+
+    def recover_autosave(self):
+        try:
+            orphans = list(orphaned_autosaves())
+        except OSError:
+            return
+
+        recovered = False
+        for path, lock in orphans:
+            try:
+                state = read_project(path)
+            except (OSError, ProjectError):
+                release_autosave(path, lock)
+                continue
+            if recovered:
+                # Left for the next start, one session at a time.
+                release_autosave(path, lock, remove=False)
+                continue
+            reply = QMessageBox.question(self, 'Recover', 'Restore unsaved work from the last session?',
+                                         QMessageBox.Yes | QMessageBox.No)
+            if reply == QMessageBox.Yes:
+                self.apply_project_state(state)
+                recovered = True
+                # The old file is the only copy until this session's
+                # autosave holds the restored state.
+                saved = self.autosave is not None and self.autosave.flush()
+                release_autosave(path, lock, remove=saved)
+            else:
+                release_autosave(path, lock)
+
+    def save_project(self):
+        if not self.canvas.image:
+            return
+
+        filename, _ = QFileDialog.getSaveFileName(self, "Save Project", "project",
+                                                  f"RGB565 Projects (*{PROJECT_EXTENSION})")
+        if filename:
+            if not filename.endswith(PROJECT_EXTENSION):
+                filename += PROJECT_EXTENSION
+            state = self.project_state()
+            threading.Thread(target=self.write_project_worker, args=(filename, state), daemon=True).start()
+
+    def write_project_worker(self, filename, state):
+        try:
+            write_project(filename, state)
+            self.projectSaved.emit(filename, "")
+        except Exception as e:
+            self.projectSaved.emit(filename, str(e))
+
+    def on_project_saved(self, filename, error):
+        if error:
+            QMessageBox.warning(self, "Error", f"Could not save project: {error}")
+        else:
+            QMessageBox.information(self, "Success", f"Project saved: {filename}")
+
+    def load_project(self):
+        filename, _ = QFileDialog.getOpenFileName(self, "Load Project", "",
+                                                  f"RGB565 Projects (*{PROJECT_EXTENSION})")
+        if filename:
+            try:
+                state = read_project(filename)
+            except (OSError, ProjectError) as e:
+                QMessageBox.warning(self, "Error", f"Could not load project: {e}")
+                return
+            self.apply_project_state(state)
+
+    def closeEvent(self, event):
+        if self.autosave:
+            self.autosave.close(remove=True)
+            self.autosave = None
+        self.stop_preview()
+        super().closeEvent(event)
+
     def keyPressEvent(self, event):
         if event.key() in (Qt.Key_Plus, Qt.Key_Equal):
             self.canvas.zoom_in()
@@ -722,6 +969,10 @@ class PixelEditor(QMainWindow):
                 self.undo()
             elif event.key() == Qt.Key_Y:
                 self.redo()
+            elif event.key() == Qt.Key_S:
+                self.save_project()
+            elif event.key() == Qt.Key_O:
+                self.load_project()
             elif event.key() == Qt.Key_A and hasattr(self, 'textEditHex'):
                 self.textEditHex.selectAll()
         super().keyPressEvent(event)
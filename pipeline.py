@@ -0,0 +1,324 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from colormath import PaletteIndex, rgb565_to_rgb888, snap_to_palette
+from export import c_identifier, write_header
+from project import ProjectError, read_project, write_project
+
+DEFAULT_CACHE_DIR = '.pipeline_cache'
+CACHE_VERSION = 1
+
+
+class PipelineError(Exception):
+    pass
+
+
+def load_png(path):
+    # Qt is only needed for PNG I/O; the stages and cache work without it.
+    from PyQt5.QtGui import QImage
+
+    image = QImage(path)
+    if image.isNull():
+        raise PipelineError(f"Could not load image: {path}")
+
+    image = image.convertToFormat(QImage.Format_RGB16)
+    w, h = image.width(), image.height()
+    bits = image.constBits()
+    bits.setsize(image.byteCount())
+    raw = bytes(bits)
+    stride = image.bytesPerLine()
+
+    data = array('H')
+    for y in range(h):
+        data.frombytes(raw[y * stride:y * stride + w * 2])
+    return {'data': data.tolist(), 'width': w, 'height': h}
+
+
+def save_png(image, path):
+    from PyQt5.QtGui import QImage
+
+    w, h = image['width'], image['height']
+    raw = array('H', image['data']).tobytes()
+    qimage = QImage(raw, w, h, w * 2, QImage.Format_RGB16).convertToFormat(QImage.Format_RGB888)
+    if not qimage.save(path, 'PNG'):
+        raise PipelineError(f"Could not save image: {path}")
+
+
+def load_palette(path):
+    try:
+        with open(path, 'r') as f:
+            colors = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PipelineError(f"Could not load palette {path}: {e}")
+    if not colors:
+        raise PipelineError(f"Palette {path} is empty")
+    return colors
+
+
+def crop(image, x, y, width, height):
+    w, h = image['width'], image['height']
+    if x < 0 or y < 0 or width < 1 or height < 1 or x + width > w or y + height > h:
+        raise PipelineError(f"Crop {x},{y} {width}x{height} is outside the {w}x{h} image")
+
+    data = image['data']
+    out = []
+    for row in range(y, y + height):
+        out.extend(data[row * w + x:row * w + x + width])
+    return {'data': out, 'width': width, 'height': height}
+
+
+def resize(image, width, height):
+    # Same semantics as the editor's size change: keep the top-left corner,
+    # pad with black.
+    if width < 1 or height < 1:
+        raise PipelineError(f"Invalid size: {width}x{height}")
+
+    w, h = image['width'], image['height']
+    data = image['data']
+    out = [0x0000] * (width * height)
+    for y in range(min(h, height)):
+        n = min(w, width)
+        out[y * width:y * width + n] = data[y * w:y * w + n]
+    return {'data': out, 'width': width, 'height': height}
+
+
+def rotate(image, turns=1):
+    # Clockwise by 90 degrees per turn
+    for _ in range(turns % 4):
+        w, h = image['width'], image['height']
+        data = image['data']
+        out = [0x0000] * (w * h)
+        for y in range(h):
+            for x in range(w):
+                out[x * h + (h - 1 - y)] = data[y * w + x]
+        image = {'data': out, 'width': h, 'height': w}
+    return image
+
+
+def quantize(image, palette):
+    return {'data': snap_to_palette(image['data'], palette), 'width': image['width'], 'height': image['height']}
+
+
+def dither(image, palette):
+    # Floyd-Steinberg error diffusion onto the palette
+    w, h = image['width'], image['height']
+    index = PaletteIndex(palette)
+    pixels = [list(rgb565_to_rgb888(value)) for value in image['data']]
+    out = []
+    for y in range(h):
+        for x in range(w):
+            r, g, b = (min(255, max(0, int(c))) for c in pixels[y * w + x])
+            color = index.nearest(((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3))
+            out.append(color)
+
+            pr, pg, pb = rgb565_to_rgb888(color)
+            error = (r - pr, g - pg, b - pb)
+            for dx, dy, weight in ((1, 0, 7 / 16), (-1, 1, 3 / 16), (0, 1, 5 / 16), (1, 1, 1 / 16)):
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < w and ny < h:
+                    target = pixels[ny * w + nx]
+                    for i in range(3):
+                        target[i] += error[i] * weight
+    return {'data': out, 'width': w, 'height': h}
+
+
+STAGES = {
+    'crop': crop,
+    'resize': resize,
+    'rotate': rotate,
+    'dither': dither,
+    'quantize': quantize,
+}
+
+
+def check_stage(name, params):
+    # Parameters are checked when the stage is added, so a bad recipe fails
+    # before any worker starts and a TypeError raised inside a stage is never
+    # mistaken for a bad parameter.
+    if name not in STAGES:
+        raise PipelineError(f"Unknown stage: {name}")
+    try:
+        inspect.signature(STAGES[name]).bind(None, **params)
+    except TypeError as e:
+        raise PipelineError(f"Invalid parameters for {name}: {e}")
+    if 'palette' in params and not params['palette']:
+        raise PipelineError(f"Empty palette for {name}")
+
+
+def apply_stages(stages, image):
+    for name, params in stages:
+        image = STAGES[name](image, **params)
+    return image
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def process_file(stages, path, cache_dir=None):
+    # Runs in a worker process. Results are cached under the hash of the
+    # input bytes and the stage list, so unchanged inputs are not rebuilt.
+    cache_path = None
+    if cache_dir:
+        spec = json.dumps([CACHE_VERSION, stages], sort_keys=True)
+        key = hashlib.sha256((file_hash(path) + spec).encode('utf-8')).hexdigest()
+        cache_path = os.path.join(cache_dir, key + '.r565p')
+        if os.path.exists(cache_path):
+            try:
+                state = read_project(cache_path)
+                return {'data': state['data'], 'width': state['width'], 'height': state['height']}, True
+            except (OSError, ProjectError):
+                pass
+
+    image = apply_stages(stages, load_png(path))
+    if cache_path:
+        write_project(cache_path, image, include_history=False)
+    return image, False
+
+
+class Pipeline:
+    # Pipelines are immutable descriptions; nothing runs until run() is
+    # iterated or build() is called, and each file streams through all stages
+    # at once.
+
+    def __init__(self, stages=()):
+        self.stages = list(stages)
+        for name, params in self.stages:
+            check_stage(name, params)
+
+    def then(self, name, **params):
+        if isinstance(params.get('palette'), str):
+            params['palette'] = load_palette(params['palette'])
+        return Pipeline(self.stages + [(name, params)])
+
+    def crop(self, x, y, width, height):
+        return self.then('crop', x=x, y=y, width=width, height=height)
+
+    def resize(self, width, height):
+        return self.then('resize', width=width, height=height)
+
+    def rotate(self, turns=1):
+        return self.then('rotate', turns=turns)
+
+    def dither(self, palette):
+        return self.then('dither', palette=palette)
+
+    def quantize(self, palette):
+        return self.then('quantize', palette=palette)
+
+    def apply(self, image):
+        return apply_stages(self.stages, image)
+
+    def run(self, paths, cache_dir=DEFAULT_CACHE_DIR, workers=None):
+        paths = list(paths)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        if workers == 1:
+            results = map(process_file, repeat(self.stages), paths, repeat(cache_dir))
+            for path, (image, cached) in zip(paths, results):
+                yield path, image, cached
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(process_file, repeat(self.stages), paths, repeat(cache_dir))
+            for path, (image, cached) in zip(paths, results):
+                yield path, image, cached
+
+    def build(self, paths, header=None, png_dir=None, cache_dir=DEFAULT_CACHE_DIR, workers=None,
+              **header_options):
+        # Runs the whole batch and returns [(path, cached), ...]. Outputs are
+        # named after the input file, so clashing names are refused up front
+        # rather than overwriting each other's PNG after all the work is done.
+        paths = list(paths)
+        names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+        if header or png_dir:
+            seen = {}
+            for path, name in zip(paths, names):
+                # Case-insensitive file systems and upper-cased header macros
+                # both fold case.
+                key = (c_identifier(name) if header else name).lower()
+                if key in seen:
+                    raise PipelineError(f"{path} and {seen[key]} would both be written as {name}")
+                seen[key] = path
+
+        images = []
+        results = []
+        if png_dir:
+            os.makedirs(png_dir, exist_ok=True)
+        for name, (path, image, cached) in zip(names, self.run(paths, cache_dir, workers)):
+            if png_dir:
+                save_png(image, os.path.join(png_dir, name + '.png'))
+            if header:
+                images.append((name, image['data'], image['width'], image['height']))
+            results.append((path, cached))
+        if header:
+            write_header(header, images, **header_options)
+        return results
+
+
+def load_recipe(path):
+    # Recipe: {"stages": [{"op": "crop", ...}, ...], "output": {...}}
+    # Palette and output paths are relative to the recipe file.
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith(('.yaml', '.yml')):
+                try:
+                    import yaml
+                except ImportError:
+                    raise PipelineError("PyYAML is required for YAML recipes")
+                recipe = yaml.safe_load(f)
+            else:
+                recipe = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PipelineError(f"Could not load recipe {path}: {e}")
+
+    base = os.path.dirname(os.path.abspath(path))
+    pipeline = Pipeline()
+    for stage in recipe.get('stages', []):
+        params = dict(stage)
+        name = params.pop('op', None)
+        if isinstance(params.get('palette'), str):
+            params['palette'] = os.path.join(base, params['palette'])
+        pipeline = pipeline.then(name, **params)
+
+    output = dict(recipe.get('output', {}))
+    for key in ('header', 'png_dir'):
+        if output.get(key):
+            output[key] = os.path.join(base, output[key])
+    return pipeline, output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an RGB565 batch-processing recipe")
+    parser.add_argument('recipe', help="JSON or YAML recipe")
+    parser.add_argument('images', nargs='+', help="PNG files to process")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--no-cache', action='store_true', help="rebuild every image")
+    args = parser.parse_args(argv)
+
+    try:
+        pipeline, output = load_recipe(args.recipe)
+        cache_dir = None if args.no_cache else DEFAULT_CACHE_DIR
+        results = pipeline.build(args.images, cache_dir=cache_dir, workers=args.workers, **output)
+        for path, cached in results:
+            print(f"{'cached' if cached else 'built '} {path}")
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
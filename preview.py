@@ -0,0 +1,279 @@
+import collections
+import socket
+import struct
+import threading
+
+from rgb565 import pack_rgb565_be, unpack_rgb565_be
+
+SYNC_HOST = 0xA5
+SYNC_DEVICE = 0x5A
+
+CMD_INIT = ord('I')
+CMD_BLIT = ord('B')
+CMD_ACK = ord('K')
+
+FRAME_HEADER = struct.Struct('<BBHHHHH')
+ACK_FRAME = struct.Struct('<BBH')
+
+DEFAULT_BAUDRATE = 2000000
+ACK_TIMEOUT = 1.0
+MAX_IN_FLIGHT = 4
+MAX_BLIT_BYTES = 4096
+
+
+class PreviewError(Exception):
+    pass
+
+
+def encode_init(seq, width, height):
+    return FRAME_HEADER.pack(SYNC_HOST, CMD_INIT, seq, 0, 0, width, height)
+
+
+def encode_blit(seq, x, y, w, h, pixels):
+    return FRAME_HEADER.pack(SYNC_HOST, CMD_BLIT, seq, x, y, w, h) + pack_rgb565_be(pixels)
+
+
+def dirty_rects(old, new, width, height):
+    if old is None or len(old) != len(new):
+        return [(0, 0, width, height)]
+
+    # Consecutive changed rows are merged into one band spanning the union of
+    # their changed columns, which keeps the number of window commands small.
+    rects = []
+    band = None
+    for y in range(height):
+        start = y * width
+        row_old, row_new = old[start:start + width], new[start:start + width]
+        if row_old == row_new:
+            if band:
+                rects.append(band)
+                band = None
+            continue
+        x0 = next(x for x in range(width) if row_old[x] != row_new[x])
+        x1 = next(x for x in range(width - 1, -1, -1) if row_old[x] != row_new[x]) + 1
+        if band:
+            bx0, by0, bx1, _ = band
+            band = (min(bx0, x0), by0, max(bx1, x1), y + 1)
+        else:
+            band = (x0, y, x1, y + 1)
+    if band:
+        rects.append(band)
+    return [(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in rects]
+
+
+def split_rect(x, y, w, h, max_bytes=MAX_BLIT_BYTES):
+    rows = max(1, max_bytes // (w * 2))
+    for ry in range(y, y + h, rows):
+        yield x, ry, w, min(rows, y + h - ry)
+
+
+def crop(data, width, x, y, w, h):
+    pixels = []
+    for row in range(y, y + h):
+        start = row * width + x
+        pixels.extend(data[start:start + w])
+    return pixels
+
+
+class SerialTransport:
+
+    def __init__(self, port, baudrate=DEFAULT_BAUDRATE):
+        try:
+            import serial
+        except ImportError:
+            raise PreviewError("pyserial is required for serial preview")
+        try:
+            self.link = serial.Serial(port, baudrate, timeout=ACK_TIMEOUT, write_timeout=ACK_TIMEOUT)
+        except serial.SerialException as e:
+            raise PreviewError(str(e))
+
+    def write(self, data):
+        self.link.write(data)
+
+    def read(self, size):
+        return self.link.read(size)
+
+    def close(self):
+        self.link.close()
+
+
+class TcpTransport:
+
+    def __init__(self, host, port):
+        try:
+            self.link = socket.create_connection((host, port), timeout=ACK_TIMEOUT)
+        except OSError as e:
+            raise PreviewError(str(e))
+        self.link.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def write(self, data):
+        self.link.sendall(data)
+
+    def read(self, size):
+        # Bytes already taken off the stream cannot be put back, so a short
+        # read leaves the link out of sync and is fatal.
+        data = b''
+        try:
+            while len(data) < size:
+                part = self.link.recv(size - len(data))
+                if not part:
+                    raise PreviewError("Device closed the connection")
+                data += part
+        except socket.timeout:
+            raise PreviewError("Device did not acknowledge")
+        return data
+
+    def close(self):
+        self.link.close()
+
+
+class LoopbackTransport:
+    # Decodes the protocol into an in-memory framebuffer and acknowledges
+    # every frame, standing in for a real panel.
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.framebuffer = []
+        self.frames = 0
+        self._buffer = bytearray()
+        self._acks = bytearray()
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        with self._lock:
+            self._buffer.extend(data)
+            self._parse()
+
+    def read(self, size):
+        with self._lock:
+            data = bytes(self._acks[:size])
+            del self._acks[:size]
+        return data
+
+    def close(self):
+        pass
+
+    def _parse(self):
+        while len(self._buffer) >= FRAME_HEADER.size:
+            sync, cmd, seq, x, y, w, h = FRAME_HEADER.unpack_from(self._buffer)
+            if sync != SYNC_HOST:
+                del self._buffer[0]
+                continue
+            size = FRAME_HEADER.size
+            if cmd == CMD_BLIT:
+                size += w * h * 2
+            if len(self._buffer) < size:
+                return
+            payload = bytes(self._buffer[FRAME_HEADER.size:size])
+            del self._buffer[:size]
+            if cmd == CMD_INIT:
+                self.width, self.height = w, h
+                self.framebuffer = [0x0000] * (w * h)
+            elif cmd == CMD_BLIT:
+                pixels = unpack_rgb565_be(payload)
+                for row in range(h):
+                    start = (y + row) * self.width + x
+                    self.framebuffer[start:start + w] = pixels[row * w:(row + 1) * w]
+            self.frames += 1
+            self._acks.extend(ACK_FRAME.pack(SYNC_DEVICE, CMD_ACK, seq))
+
+
+def open_transport(spec):
+    # "loopback", "tcp:host:port" or "serial:port[@baudrate]"
+    kind, _, target = spec.partition(':')
+    if kind == 'loopback':
+        return LoopbackTransport()
+    if kind == 'tcp':
+        host, _, port = target.rpartition(':')
+        if not host or not port.isdigit():
+            raise PreviewError(f"Invalid TCP address: {target}")
+        return TcpTransport(host, int(port))
+    if kind == 'serial':
+        port, _, baudrate = target.partition('@')
+        if not port or (baudrate and not baudrate.isdigit()):
+            raise PreviewError(f"Invalid serial port: {target}")
+        return SerialTransport(port, int(baudrate) if baudrate else DEFAULT_BAUDRATE)
+    raise PreviewError(f"Unknown transport: {spec}")
+
+
+class PreviewSender:
+
+    def __init__(self, transport, max_in_flight=MAX_IN_FLIGHT, max_blit_bytes=MAX_BLIT_BYTES):
+        self.transport = transport
+        self.max_in_flight = max_in_flight
+        self.max_blit_bytes = max_blit_bytes
+        self.error = None
+        self._seq = 0
+        self._outstanding = collections.deque()
+        self._sent = None
+        self._sent_size = None
+        self._pending = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='preview', daemon=True)
+        self._thread.start()
+
+    def submit(self, data, width, height):
+        # Only the newest frame is kept; since it is diffed against what the
+        # device already shows, skipping intermediate frames loses nothing.
+        with self._lock:
+            self._pending = (list(data), width, height)
+        self._wake.set()
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.transport.close()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                frame, self._pending = self._pending, None
+            if frame is not None and self.error is None:
+                try:
+                    self._send_frame(*frame)
+                except (OSError, PreviewError) as e:
+                    self.error = e
+            if self._closed:
+                break
+
+    def _next_seq(self):
+        self._seq = (self._seq + 1) & 0xFFFF
+        return self._seq
+
+    def _send_frame(self, data, width, height):
+        if self._sent_size != (width, height):
+            seq = self._next_seq()
+            self._send(seq, encode_init(seq, width, height))
+            self._sent = None
+            self._sent_size = (width, height)
+
+        for rect in dirty_rects(self._sent, data, width, height):
+            for x, y, w, h in split_rect(*rect, self.max_blit_bytes):
+                seq = self._next_seq()
+                self._send(seq, encode_blit(seq, x, y, w, h, crop(data, width, x, y, w, h)))
+        self._sent = data
+
+    def _send(self, seq, frame):
+        self.transport.write(frame)
+        self._outstanding.append(seq)
+        while len(self._outstanding) >= self.max_in_flight:
+            self._wait_ack()
+
+    def _wait_ack(self):
+        ack = self.transport.read(ACK_FRAME.size)
+        if len(ack) < ACK_FRAME.size:
+            raise PreviewError("Device did not acknowledge")
+        sync, cmd, seq = ACK_FRAME.unpack(ack)
+        if sync != SYNC_DEVICE or cmd != CMD_ACK:
+            raise PreviewError("Unexpected reply from device")
+        # Frames are acknowledged in order; anything else means a frame was
+        # dropped or the device is answering someone else.
+        expected = self._outstanding.popleft()
+        if seq != expected:
+            raise PreviewError(f"Device acknowledged frame {seq}, expected {expected}")
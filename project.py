@@ -0,0 +1,344 @@
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+from rgb565 import pack_rgb565, unpack_rgb565
+
+PROJECT_MAGIC = b'R565PRJ\x00'
+PROJECT_VERSION = 1
+PROJECT_EXTENSION = '.r565p'
+AUTOSAVE_PREFIX = 'autosave-'
+AUTOSAVE_MAX_SIZE = 4 * 1024 * 1024
+AUTOSAVE_FLUSH_TIMEOUT = 5.0
+
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+COMPRESS_MIN_SIZE = 64
+COMPRESS_LEVEL = 6
+
+HISTORY_FULL = 0
+HISTORY_DELTA = 1
+
+FILE_HEADER = struct.Struct('<8sH')
+CHUNK_HEADER = struct.Struct('<4sBII')
+HISTORY_HEADER = struct.Struct('<HHB')
+
+TAG_HEAD = b'HEAD'
+TAG_IMAGE = b'IMAG'
+TAG_PALETTE = b'PALT'
+TAG_HISTORY = b'HIST'
+TAG_END = b'END '
+
+
+class ProjectError(Exception):
+    pass
+
+
+def xor_bytes(a, b):
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+
+def encode_chunk(tag, payload, compress=True):
+    codec = CODEC_RAW
+    if compress and len(payload) >= COMPRESS_MIN_SIZE:
+        packed = zlib.compress(payload, COMPRESS_LEVEL)
+        if len(packed) < len(payload):
+            payload, codec = packed, CODEC_ZLIB
+    return CHUNK_HEADER.pack(tag, codec, len(payload), zlib.crc32(payload)) + payload
+
+
+def iter_chunks(f):
+    # A short read or a CRC mismatch marks the end of usable data, so a file
+    # cut off mid-write still yields every chunk written before the crash.
+    while True:
+        header = f.read(CHUNK_HEADER.size)
+        if len(header) < CHUNK_HEADER.size:
+            return
+        tag, codec, length, crc = CHUNK_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        if codec == CODEC_ZLIB:
+            try:
+                payload = zlib.decompress(payload)
+            except zlib.error:
+                return
+        elif codec != CODEC_RAW:
+            return
+        yield tag, payload
+
+
+def encode_history(history):
+    chunks = []
+    prev = None
+    for entry in history:
+        w, h = entry['width'], entry['height']
+        raw = pack_rgb565(entry['data'])
+        if prev is not None and prev[0] == w and prev[1] == h and len(prev[2]) == len(raw):
+            body = HISTORY_HEADER.pack(w, h, HISTORY_DELTA) + xor_bytes(raw, prev[2])
+        else:
+            body = HISTORY_HEADER.pack(w, h, HISTORY_FULL) + raw
+        chunks.append(encode_chunk(TAG_HISTORY, body))
+        prev = (w, h, raw)
+    return b''.join(chunks)
+
+
+def decode_history(payloads):
+    history = []
+    prev = None
+    for payload in payloads:
+        w, h, kind = HISTORY_HEADER.unpack_from(payload)
+        raw = payload[HISTORY_HEADER.size:]
+        if kind == HISTORY_DELTA:
+            if prev is None or len(prev) != len(raw):
+                raise ProjectError("History delta without a matching base state")
+            raw = xor_bytes(raw, prev)
+        history.append({'data': unpack_rgb565(raw), 'width': w, 'height': h})
+        prev = raw
+    return history
+
+
+def encode_snapshot(state, include_history=True):
+    history = (state.get('history') or []) if include_history else []
+    head = {
+        'width': state['width'],
+        'height': state['height'],
+        'selection': state.get('selection'),
+        'history_index': state.get('history_index', -1) if history else -1,
+    }
+    parts = [
+        encode_chunk(TAG_HEAD, json.dumps(head).encode('utf-8'), compress=False),
+        encode_chunk(TAG_IMAGE, pack_rgb565(state['data'])),
+        encode_chunk(TAG_PALETTE, pack_rgb565(state.get('palette') or [])),
+    ]
+    if history:
+        parts.append(encode_history(history))
+    parts.append(encode_chunk(TAG_END, b'', compress=False))
+    return b''.join(parts)
+
+
+def decode_snapshot(chunks, history_payloads):
+    if TAG_HEAD not in chunks or TAG_IMAGE not in chunks:
+        raise ProjectError("Snapshot is missing image data")
+    head = json.loads(chunks[TAG_HEAD].decode('utf-8'))
+    data = unpack_rgb565(chunks[TAG_IMAGE])
+    if len(data) != head['width'] * head['height']:
+        raise ProjectError("Image data does not match canvas size")
+    history = decode_history(history_payloads)
+    return {
+        'width': head['width'],
+        'height': head['height'],
+        'data': data,
+        'palette': unpack_rgb565(chunks.get(TAG_PALETTE, b'')),
+        'selection': head.get('selection'),
+        'history': history,
+        'history_index': head.get('history_index', -1) if history else -1,
+    }
+
+
+def file_header():
+    return FILE_HEADER.pack(PROJECT_MAGIC, PROJECT_VERSION)
+
+
+def read_header(f):
+    header = f.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size:
+        raise ProjectError("Not a project file")
+    magic, version = FILE_HEADER.unpack(header)
+    if magic != PROJECT_MAGIC:
+        raise ProjectError("Not a project file")
+    if version > PROJECT_VERSION:
+        raise ProjectError(f"Unsupported project version: {version}")
+
+
+def write_atomic(path, data):
+    # A unique temp file per call, so overlapping saves to the same path
+    # (quick repeated Ctrl+S, parallel pipeline workers) never share one.
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_project(path, state, include_history=True):
+    write_atomic(path, file_header() + encode_snapshot(state, include_history))
+
+
+def read_project(path):
+    # Files may hold several snapshots appended one after another (autosave);
+    # the last one terminated by an END chunk wins.
+    state = None
+    chunks = {}
+    history_payloads = []
+    with open(path, 'rb') as f:
+        read_header(f)
+        for tag, payload in iter_chunks(f):
+            if tag == TAG_END:
+                state = decode_snapshot(chunks, history_payloads)
+                chunks = {}
+                history_payloads = []
+            elif tag == TAG_HISTORY:
+                history_payloads.append(payload)
+            else:
+                chunks[tag] = payload
+    if state is None:
+        raise ProjectError("No complete snapshot found")
+    return state
+
+
+def autosave_dir():
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Application Support')
+    else:
+        base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    return os.path.join(base, 'rgb565_editor', 'autosave')
+
+
+def try_lock(f):
+    try:
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def claim_autosave(path):
+    # Every running editor holds a lock on its own autosave; a file whose
+    # lock can be taken belongs to a session that is gone. Returns the open
+    # lock file on success, None if the owner is still running.
+    lock = open(path + '.lock', 'a+b')
+    if try_lock(lock):
+        return lock
+    lock.close()
+    return None
+
+
+def release_autosave(path, lock, remove=True):
+    lock.close()
+    if remove:
+        for name in (path, path + '.lock'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+
+def orphaned_autosaves(directory=None):
+    # Yields (path, lock) for autosaves left behind by sessions that ended
+    # without a clean exit, newest first. The caller must release each lock.
+    directory = directory or autosave_dir()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    paths = [os.path.join(directory, name) for name in names
+             if name.startswith(AUTOSAVE_PREFIX) and name.endswith(PROJECT_EXTENSION)]
+    for path in sorted(paths, key=os.path.getmtime, reverse=True):
+        lock = claim_autosave(path)
+        if lock:
+            yield path, lock
+
+
+class AutosaveWriter:
+
+    def __init__(self, directory=None, max_size=AUTOSAVE_MAX_SIZE):
+        directory = directory or autosave_dir()
+        os.makedirs(directory, exist_ok=True)
+        name = f'{AUTOSAVE_PREFIX}{os.getpid()}-{time.time_ns()}{PROJECT_EXTENSION}'
+        self.path = os.path.join(directory, name)
+        self._owner_lock = claim_autosave(self.path)
+        self.max_size = max_size
+        self.error = None
+        self._file = None
+        self._pending = None
+        self._closed = False
+        self._submitted = 0
+        self._written = 0
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='autosave', daemon=True)
+        self._thread.start()
+
+    def submit(self, state):
+        # Only the newest state is kept: bursts of edits collapse into one write.
+        with self._lock:
+            self._pending = state
+            self._submitted += 1
+        self._wake.set()
+
+    def flush(self, timeout=AUTOSAVE_FLUSH_TIMEOUT):
+        # Waits until everything submitted so far is on disk. Returns False on
+        # timeout or after a write error.
+        with self._lock:
+            target = self._submitted
+            written = self._done.wait_for(lambda: self._written >= target, timeout)
+        return written and self.error is None
+
+    def close(self, remove=False):
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        if self._owner_lock:
+            release_autosave(self.path, self._owner_lock, remove)
+            self._owner_lock = None
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                state, self._pending = self._pending, None
+                target = self._submitted
+            if state is not None:
+                try:
+                    self._append(state)
+                except (OSError, ValueError) as e:
+                    self.error = e
+            with self._lock:
+                self._written = target
+                self._done.notify_all()
+            if self._closed:
+                break
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _append(self, state):
+        snapshot = encode_snapshot(state, include_history=False)
+        if self._file is None or self._file.tell() + len(snapshot) > self.max_size:
+            self._compact(snapshot)
+            return
+        self._file.write(snapshot)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _compact(self, snapshot):
+        if self._file:
+            self._file.close()
+            self._file = None
+        write_atomic(self.path, file_header() + snapshot)
+        self._file = open(self.path, 'ab')
@@ -0,0 +1,33 @@
+import sys
+from array import array
+
+
+def pack_rgb565(data):
+    buf = array('H', data)
+    if sys.byteorder == 'big':
+        buf.byteswap()
+    return buf.tobytes()
+
+
+def unpack_rgb565(raw):
+    buf = array('H')
+    buf.frombytes(raw)
+    if sys.byteorder == 'big':
+        buf.byteswap()
+    return buf.tolist()
+
+
+def pack_rgb565_be(data):
+    # Panels such as ST7789/ILI9341 take RGB565 high byte first.
+    buf = array('H', data)
+    if sys.byteorder == 'little':
+        buf.byteswap()
+    return buf.tobytes()
+
+
+def unpack_rgb565_be(raw):
+    buf = array('H')
+    buf.frombytes(raw)
+    if sys.byteorder == 'little':
+        buf.byteswap()
+    return buf.tolist()
@@ -0,0 +1,67 @@
+import random
+
+from colormath import JND_DELTA_E, PaletteIndex, delta_e, fill_region, merge_similar, snap_to_palette
+
+
+def random_colors(count, seed):
+    rng = random.Random(seed)
+    return [rng.randrange(0x10000) for _ in range(count)]
+
+
+def test_nearest_matches_brute_force():
+    palette = random_colors(200, seed=1)
+    index = PaletteIndex(palette)
+
+    for color in random_colors(500, seed=2) + palette[:10]:
+        best = min(delta_e(color, other) for other in palette)
+        # Ties may resolve to a different color at the same distance.
+        assert delta_e(color, index.nearest(color)) == best
+    assert PaletteIndex().nearest(0x1234) is None
+
+
+def test_within_matches_brute_force():
+    palette = random_colors(300, seed=3)
+    index = PaletteIndex(palette)
+
+    for color in random_colors(50, seed=4):
+        for radius in (JND_DELTA_E, 10.0, 25.0):
+            expected = sorted(other for other in palette if delta_e(color, other) <= radius)
+            assert sorted(index.within(color, radius)) == expected
+
+
+def test_merge_similar_groups_close_colors():
+    colors = random_colors(400, seed=5)
+    threshold = 8.0
+    merged = merge_similar(colors, threshold)
+
+    # Order is kept, kept colors are pairwise distinct enough, and every input
+    # is represented by a kept color.
+    assert merged == [color for color in dict.fromkeys(colors) if color in merged]
+    for i, a in enumerate(merged):
+        assert all(delta_e(a, b) > threshold for b in merged[i + 1:])
+    for color in colors:
+        assert any(delta_e(color, kept) <= threshold for kept in merged)
+
+    assert merge_similar([0xF800, 0xF800, 0xF820, 0x001F]) == [0xF800, 0x001F]
+
+
+def test_snap_to_palette():
+    assert snap_to_palette([0xF810, 0x0010, 0xFFDF], [0x0000, 0xFFFF, 0xF800]) == [0xF800, 0x0000, 0xFFFF]
+    assert snap_to_palette([1, 2], []) == [1, 2]
+
+
+def test_fill_region_exact_and_tolerant():
+    red, near_red, blue = 0xF800, 0xF820, 0x001F
+    data = [
+        red, red, blue, red,
+        near_red, red, blue, red,
+        blue, blue, blue, red,
+    ]
+
+    exact = fill_region(data, 4, 3, 0, 0)
+    assert sorted(exact) == [(0, 0), (1, 0), (1, 1)]
+
+    # The near-red pixel joins, but red behind the blue wall stays unreachable.
+    tolerant = fill_region(data, 4, 3, 0, 0, tolerance=JND_DELTA_E)
+    assert sorted(tolerant) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+    assert len(fill_region(data, 4, 3, 0, 0, tolerance=500)) == 12
@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+import pipeline
+from pipeline import Pipeline, PipelineError, crop, dither, load_recipe, resize, rotate
+
+BLACK, WHITE = 0x0000, 0xFFFF
+
+
+def make_image(width, height):
+    return {'data': [(i * 2654435761) & 0xFFFF for i in range(width * height)], 'width': width, 'height': height}
+
+
+def test_rotate_four_turns_is_identity():
+    image = make_image(5, 3)
+    turned = rotate(image)
+
+    assert (turned['width'], turned['height']) == (3, 5)
+    # Clockwise: the bottom-left pixel ends up top-left.
+    assert turned['data'][0] == image['data'][2 * 5]
+    assert rotate(image, 4) == image
+    assert rotate(rotate(rotate(turned))) == image
+
+
+def test_resize_keeps_top_left_corner_and_crop_extracts():
+    image = make_image(4, 3)
+    data = image['data']
+
+    grown = resize(image, 6, 4)
+    assert grown['data'][:4] == data[:4]
+    assert grown['data'][6:10] == data[4:8]
+    assert grown['data'][4:6] == [BLACK, BLACK]
+    assert grown['data'][18:] == [BLACK] * 6
+    assert resize(grown, 4, 3) == image
+
+    assert crop(image, 1, 1, 2, 2)['data'] == [data[5], data[6], data[9], data[10]]
+    with pytest.raises(PipelineError):
+        crop(image, 3, 0, 2, 1)
+
+
+def test_dither_only_uses_palette_colors():
+    gray = {'data': [0x8410] * 16, 'width': 4, 'height': 4}
+    out = dither(gray, [BLACK, WHITE])['data']
+
+    assert set(out) == {BLACK, WHITE}
+    # Mid gray diffuses into a roughly even mix.
+    assert 4 <= out.count(WHITE) <= 12
+
+
+def test_invalid_stages_are_rejected_up_front():
+    with pytest.raises(PipelineError):
+        Pipeline().then('resize', width=4)
+    with pytest.raises(PipelineError):
+        Pipeline().then('rotate', turn=1)
+    with pytest.raises(PipelineError):
+        Pipeline().then('dither', palette=[])
+    with pytest.raises(PipelineError):
+        Pipeline().then('blur')
+
+
+def test_load_recipe_resolves_paths_relative_to_recipe(tmp_path):
+    (tmp_path / 'bw.json').write_text(json.dumps([BLACK, WHITE]))
+    (tmp_path / 'recipe.json').write_text(json.dumps({
+        'stages': [{'op': 'rotate', 'turns': 2}, {'op': 'quantize', 'palette': 'bw.json'}],
+        'output': {'header': 'out/sprites.h'},
+    }))
+
+    built, output = load_recipe(str(tmp_path / 'recipe.json'))
+
+    assert built.stages == [('rotate', {'turns': 2}), ('quantize', {'palette': [BLACK, WHITE]})]
+    assert output == {'header': str(tmp_path / 'out' / 'sprites.h')}
+
+
+def test_second_build_is_served_from_cache(tmp_path, monkeypatch):
+    loads = []
+
+    def load_png(path):
+        loads.append(path)
+        return make_image(4, 2)
+
+    monkeypatch.setattr(pipeline, 'load_png', load_png)
+    paths = []
+    for name in ('a', 'b'):
+        path = tmp_path / f'{name}.png'
+        path.write_bytes(name.encode('ascii'))
+        paths.append(str(path))
+    cache_dir = str(tmp_path / 'cache')
+    header = str(tmp_path / 'sprites.h')
+    steps = Pipeline().rotate().resize(2, 2)
+
+    assert steps.build(paths, header=header, cache_dir=cache_dir, workers=1) == [(p, False) for p in paths]
+    first = (tmp_path / 'sprites.h').read_text()
+    assert steps.build(paths, header=header, cache_dir=cache_dir, workers=1) == [(p, True) for p in paths]
+    assert (tmp_path / 'sprites.h').read_text() == first
+    assert len(loads) == 2
+
+    # Changed input bytes or a changed stage list miss the cache.
+    (tmp_path / 'a.png').write_bytes(b'changed')
+    assert steps.build(paths, cache_dir=cache_dir, workers=1) == [(paths[0], False), (paths[1], True)]
+    assert steps.rotate().build(paths[1:], cache_dir=cache_dir, workers=1) == [(paths[1], False)]
+
+
+def test_clashing_output_names_fail_before_processing(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, 'load_png', lambda path: pytest.fail("image was loaded"))
+
+    with pytest.raises(PipelineError):
+        Pipeline().build(['a/icon.png', 'b/icon.png'], header=str(tmp_path / 'x.h'), cache_dir=None, workers=1)
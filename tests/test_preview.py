@@ -0,0 +1,79 @@
+import socket
+import time
+
+import pytest
+
+from preview import ACK_FRAME, LoopbackTransport, PreviewError, PreviewSender, TcpTransport, dirty_rects
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_dirty_rects_merge_consecutive_rows():
+    old = [0] * 12
+    new = list(old)
+    new[1] = new[6] = 1
+    new[11] = 2
+
+    assert dirty_rects(old, new, 4, 3) == [(1, 0, 3, 3)]
+    assert dirty_rects(None, new, 4, 3) == [(0, 0, 4, 3)]
+
+
+def test_sender_streams_to_loopback_across_resize():
+    device = LoopbackTransport()
+    sender = PreviewSender(device, max_in_flight=2, max_blit_bytes=32)
+    try:
+        frame = [(i * 2654435761) & 0xFFFF for i in range(20 * 12)]
+        sender.submit(frame, 20, 12)
+        assert wait_for(lambda: device.framebuffer == frame)
+        full_frames = device.frames
+
+        edited = list(frame)
+        edited[3 * 20 + 7] = 0xF800
+        sender.submit(edited, 20, 12)
+        assert wait_for(lambda: device.framebuffer == edited)
+        # A single changed pixel is sent as one small blit.
+        assert device.frames == full_frames + 1
+
+        resized = [0x07E0] * (7 * 9)
+        sender.submit(resized, 7, 9)
+        assert wait_for(lambda: (device.width, device.height) == (7, 9) and device.framebuffer == resized)
+    finally:
+        sender.close()
+    assert sender.error is None
+
+
+class SkippingTransport(LoopbackTransport):
+    # Acknowledges every frame with the sequence number of the next one.
+
+    def read(self, size):
+        sync, cmd, seq = ACK_FRAME.unpack(super().read(size))
+        return ACK_FRAME.pack(sync, cmd, seq + 1)
+
+
+def test_out_of_order_ack_stops_sender():
+    sender = PreviewSender(SkippingTransport(), max_in_flight=1)
+    try:
+        sender.submit([0] * 4, 2, 2)
+        assert wait_for(lambda: sender.error is not None)
+    finally:
+        sender.close()
+    assert isinstance(sender.error, PreviewError)
+
+
+def test_tcp_short_read_is_fatal():
+    server = socket.create_server(('127.0.0.1', 0))
+    try:
+        transport = TcpTransport('127.0.0.1', server.getsockname()[1])
+        peer, _ = server.accept()
+        peer.sendall(b'\x5a\x4b')
+        peer.close()
+        with pytest.raises(PreviewError):
+            transport.read(ACK_FRAME.size)
+        transport.close()
+    finally:
+        server.close()
@@ -0,0 +1,69 @@
+import os
+
+from project import (AutosaveWriter, encode_snapshot, file_header, orphaned_autosaves,
+                     read_project, release_autosave, write_project)
+
+
+def make_state(width, height, seed=0):
+    return {
+        'width': width,
+        'height': height,
+        'data': [(seed * 977 + i * 31) & 0xFFFF for i in range(width * height)],
+        'palette': [0x0000, 0xFFFF, 0xF800],
+        'selection': [1, 1, 2, 3],
+    }
+
+
+def test_round_trip_with_history(tmp_path):
+    state = make_state(4, 3)
+    edited = dict(make_state(4, 3), data=list(state['data']))
+    edited['data'][5] = 0x1234
+    resized = make_state(2, 6, seed=1)
+    state['history'] = [
+        {'data': make_state(4, 3, seed=2)['data'], 'width': 4, 'height': 3},
+        {'data': edited['data'], 'width': 4, 'height': 3},
+        {'data': resized['data'], 'width': 2, 'height': 6},
+    ]
+    state['history_index'] = 1
+
+    path = str(tmp_path / 'sprite.r565p')
+    write_project(path, state)
+
+    assert read_project(path) == state
+    assert os.listdir(tmp_path) == ['sprite.r565p']
+
+
+def test_cut_off_autosave_keeps_last_complete_snapshot(tmp_path):
+    first, second = make_state(3, 3, seed=1), make_state(3, 3, seed=2)
+    tail = encode_snapshot(second, include_history=False)
+    path = str(tmp_path / 'autosave.r565p')
+
+    for cut in (1, len(tail) // 2, len(tail) - 1):
+        with open(path, 'wb') as f:
+            f.write(file_header())
+            f.write(encode_snapshot(first, include_history=False))
+            f.write(tail[:-cut])
+        assert read_project(path)['data'] == first['data']
+
+
+def test_autosave_writer_and_orphan_recovery(tmp_path):
+    state = make_state(5, 2)
+    running = AutosaveWriter(str(tmp_path))
+    running.submit(make_state(5, 2, seed=9))
+
+    # Closing without removal leaves the file unlocked, as a crash would.
+    crashed = AutosaveWriter(str(tmp_path))
+    crashed.submit(state)
+    crashed.close()
+
+    assert running.flush()
+    assert os.path.exists(running.path)
+
+    orphans = list(orphaned_autosaves(str(tmp_path)))
+    assert [path for path, _ in orphans] == [crashed.path]
+    assert read_project(crashed.path)['data'] == state['data']
+    for path, lock in orphans:
+        release_autosave(path, lock)
+
+    running.close(remove=True)
+    assert os.listdir(tmp_path) == []